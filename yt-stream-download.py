@@ -1,25 +1,245 @@
-import yt_dlp
+import concurrent.futures
 import datetime
+import itertools
 import os
+import queue
+import re
+import signal
 import threading
 import logging
+import logging.handlers
 import sys
 import shutil
+import subprocess
 import json
-import time  
+import time
 from constants import CONFIG_FILE, DEFAULT_SEGMENT_DURATION, DEFAULT_OUTPUT_DIR, DEFAULT_LOG_FILE
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 shutdown_event = threading.Event()
 
+# Local binding for the per-segment hot path; skips the attribute-chain
+# lookup on every call over a long recording session.
+_strftime = time.strftime
+
+# Monotonic per-process segment counter: guarantees unique filenames even
+# when two segments of one stream start within the same clock second,
+# without paying for a urandom-backed uuid per segment.
+_segment_counter = itertools.count()
+
+_concurrency_controller = None
+_convert_pool = None
+
+# Child ffmpeg processes spawned by this script, so a SIGINT can be
+# cascaded to them immediately instead of letting the current segment
+# run to completion. (ffmpeg children spawned internally by yt-dlp do
+# not appear here; in a terminal they receive the Ctrl+C directly as
+# part of the foreground process group.)
+_child_procs = set()
+_child_procs_lock = threading.Lock()
+
+
+def _register_child(proc):
+    with _child_procs_lock:
+        _child_procs.add(proc)
+
+
+def _unregister_child(proc):
+    with _child_procs_lock:
+        _child_procs.discard(proc)
+
+
+def _on_sigint(signum, frame):
+    """SIGINT handler: signals shutdown and terminates spawned ffmpeg children.
+
+    Re-raises KeyboardInterrupt afterwards so the normal Ctrl+C handling
+    in start_downloads still runs.
+    """
+    shutdown_event.set()
+    if _concurrency_controller is not None:
+        _concurrency_controller.stop()
+    with _child_procs_lock:
+        children = list(_child_procs)
+    for proc in children:
+        try:
+            proc.terminate()
+        except OSError:
+            pass
+    raise KeyboardInterrupt
+
+# Directories already created this run; makes repeated _ensure_dir calls a
+# set lookup instead of a mkdir/stat syscall.
+_made_dirs = set()
+
+
+def _ensure_dir(path):
+    """Creates the directory once per process; later calls are free."""
+    if path in _made_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    _made_dirs.add(path)
+
+
+_ydl_cache = {}
+_ydl_cache_lock = threading.Lock()
+
+
+def _get_cached_ydl(cache_key, ydl_opts):
+    """Returns a cached YoutubeDL for this stream, constructing it once.
+
+    Building a YoutubeDL re-loads extractors and redoes player/consent
+    round-trips, so instances are reused across segments and only the
+    output template is varied per download.
+    """
+    # Imported here (not at module level) so startup and the scheduling
+    # wait never pay yt-dlp's large import cost; sys.modules makes every
+    # call after the first free.
+    import yt_dlp
+
+    with _ydl_cache_lock:
+        ydl = _ydl_cache.get(cache_key)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+            _ydl_cache[cache_key] = ydl
+        return ydl
+
+
+def _close_cached_ydls():
+    """Closes and discards all cached YoutubeDL instances."""
+    with _ydl_cache_lock:
+        for ydl in _ydl_cache.values():
+            try:
+                ydl.close()
+            except Exception as e:
+                logging.warning(f'Error closing cached YoutubeDL instance: {e}')
+        _ydl_cache.clear()
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD (additive-increase/multiplicative-decrease) controller for the
+    number of downloads allowed to run at the same time.
+
+    Workers call acquire()/release() around each download. yt-dlp progress
+    hooks feed (bytes, elapsed) samples into a queue; a monitor thread
+    periodically estimates aggregate throughput and raises the concurrency
+    limit by one while throughput keeps improving, or halves it when
+    throughput drops (e.g. under throttling or congestion).
+    """
+
+    def __init__(self, min_workers, max_workers, interval_sec=5.0):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.interval_sec = interval_sec
+        self._limit = self.max_workers
+        self._active = 0
+        self._cv = threading.Condition()
+        self._samples = queue.SimpleQueue()
+        self._last_throughput = 0.0
+        self._stopped = False
+        self._monitor_thread = threading.Thread(
+            target=self._monitor_loop, name='ConcurrencyMonitor', daemon=True
+        )
+
+    def start(self):
+        self._monitor_thread.start()
+
+    def stop(self):
+        """Stops the monitor and wakes any workers blocked in acquire()."""
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+
+    def progress_hook(self, progress):
+        """yt-dlp progress hook; records a throughput sample per callback."""
+        if progress.get('status') != 'downloading':
+            return
+        downloaded = progress.get('downloaded_bytes')
+        elapsed = progress.get('elapsed')
+        if downloaded and elapsed:
+            self._samples.put((downloaded, elapsed))
+
+    def acquire(self):
+        """Blocks until a download slot is free. Returns False on shutdown."""
+        with self._cv:
+            while self._active >= self._limit:
+                if self._stopped:
+                    return False
+                self._cv.wait()
+            if self._stopped:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._cv:
+            self._active -= 1
+            self._cv.notify_all()
+
+    def _drain_throughput(self):
+        """Averages the per-sample rates collected since the last check."""
+        total_rate = 0.0
+        count = 0
+        while True:
+            try:
+                downloaded, elapsed = self._samples.get_nowait()
+            except queue.Empty:
+                break
+            if elapsed > 0:
+                total_rate += downloaded / elapsed
+                count += 1
+        return (total_rate / count) if count else None
+
+    def _monitor_loop(self):
+        while not shutdown_event.wait(timeout=self.interval_sec):
+            with self._cv:
+                if self._stopped:
+                    return
+            throughput = self._drain_throughput()
+            if throughput is None:
+                continue
+            with self._cv:
+                if throughput >= self._last_throughput * 1.05:
+                    if self._limit < self.max_workers:
+                        self._limit += 1
+                        logging.debug(f'Throughput rising; raising concurrency limit to {self._limit}.')
+                elif throughput < self._last_throughput * 0.75:
+                    new_limit = max(self.min_workers, self._limit // 2)
+                    if new_limit != self._limit:
+                        self._limit = new_limit
+                        logging.info(f'Throughput dropped; lowering concurrency limit to {self._limit}.')
+                self._last_throughput = throughput
+                self._cv.notify_all()
+
 def setup_logging(log_file=None):
-    """Sets up logging to console and optionally to a log file."""
+    """Sets up logging to console and optionally to a log file.
+
+    Log records are enqueued on a QueueHandler and written out by a
+    background QueueListener, so download threads never block on console
+    or disk I/O while logging. Returns the listener; the caller must
+    stop() it on exit to flush remaining records.
+    """
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
 
+    # Line-buffered, write-through stdout: each record leaves the process
+    # as one write, so log lines stay whole and nothing sits in the text
+    # buffer. Only the queue listener thread writes here, so its buffer
+    # lock is uncontended.
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=True, write_through=True)
+
     log_format = '%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'
     formatter = logging.Formatter(log_format)
 
-    handlers = [logging.StreamHandler(sys.stdout)]
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    handlers = [console_handler]
 
     if log_file:
         try:
@@ -29,25 +249,61 @@ def setup_logging(log_file=None):
         except Exception as e:
             print(f"Failed to set up log file handler for {log_file}: {e}", file=sys.stderr)
             print("Continuing with console logging only.", file=sys.stderr)
-            logging.info("Continuing with console logging only.")
             log_file = None
 
-    logging.basicConfig(level=logging.INFO, format=log_format, handlers=handlers)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
 
     if log_file:
         logging.info(f'Logging to file: {log_file}')
     else:
         logging.info('Logging to console only.')
 
+    return listener
+
+
+_config_cache = None
+
+# Keys every stream entry must carry; a frozenset so validation is one
+# C-level subset check instead of a rebuilt tuple per stream.
+_REQUIRED_STREAM_KEYS = frozenset(('url', 'stream_name', 'quality'))
+
 
 def load_configuration(config_path):
-    """Loads configuration from JSON file and validates it."""
+    """Loads configuration from JSON file and validates it.
+
+    The parsed config is cached against the file's path, mtime and size,
+    so repeated loads skip JSON decoding unless the file changed on disk.
+    Parsing
+    uses orjson when available, falling back to the stdlib json module.
+    """
+    global _config_cache
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        file_stat = os.stat(config_path)
+        cache_key = (config_path, file_stat.st_mtime_ns, file_stat.st_size)
+        if _config_cache is not None and _config_cache[0] == cache_key:
+            logging.debug(f'Using cached configuration for {config_path}')
+            return _config_cache[1]
+
+        with open(config_path, 'rb') as f:
+            config = _json_loads(f.read())
 
         if 'streams' not in config or not isinstance(config['streams'], list):
             raise ValueError("Config missing 'streams' list or 'streams' is not a list.")
+
+        # Validate stream entries once here so start_downloads does not
+        # re-check every entry on each call.
+        valid_streams = []
+        for stream_config in config['streams']:
+            if isinstance(stream_config, dict) and _REQUIRED_STREAM_KEYS.issubset(stream_config):
+                valid_streams.append(stream_config)
+            else:
+                logging.warning(f'Skipping invalid stream entry: {stream_config}. Must be a dict with "url", "stream_name", and "quality".')
+        config['streams'] = valid_streams
+
         if 'output_dir' not in config:
             logging.warning(f"'output_dir' not found in config, using default: {DEFAULT_OUTPUT_DIR}")
             config['output_dir'] = DEFAULT_OUTPUT_DIR
@@ -61,6 +317,7 @@ def load_configuration(config_path):
             logging.warning(f"'schedule_enabled' not found in config, defaulting to False.")
             config['schedule_enabled'] = False
 
+        _config_cache = (cache_key, config)
         return config
     except FileNotFoundError:
         logging.error(f"Configuration file not found: {config_path}")
@@ -75,6 +332,11 @@ def load_configuration(config_path):
         logging.error(f"An unexpected error occurred while loading configuration: {e}")
         sys.exit(1)
 
+# Valid 24-hour HH:MM input; compiling once keeps the retry loop free of
+# exception-driven parsing.
+_HHMM_PATTERN = re.compile(r'^(?:[01]?\d|2[0-3]):[0-5]\d$')
+
+
 def get_start_time_from_user():
     """
     Prompts user for start time as HH:MM or 'start now'.
@@ -89,92 +351,424 @@ def get_start_time_from_user():
         if user_input == 'start now':
             return None
 
-        try:
-            parts = user_input.split(':')
-            if len(parts) != 2:
-                raise ValueError("Input must contain exactly one colon.")
+        if _HHMM_PATTERN.match(user_input):
+            hour, minute = user_input.split(':')
+            return int(hour), int(minute)
 
-            hour = int(parts[0])
-            minute = int(parts[1])
+        print("Invalid format or value. Please enter time as HH:MM (e.g., 09:30 or 17:45), or type 'start now'.")
 
-            if not (0 <= hour <= 23 and 0 <= minute <= 59):
-                raise ValueError("Hour must be between 00-23 and Minute between 00-59.")
 
-            return hour, minute
-        except ValueError as e:
-            print(f"Invalid format or value: {e}. Please enter time as HH:MM (e.g., 09:30 or 17:45), or type 'start now'.")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}. Please try again.")
+def _remove_part_file(file_path):
+    """Removes one leftover partial file. Returns True if it was deleted."""
+    # %s-style arguments defer message formatting until a handler actually
+    # emits the record; with thousands of leftovers that adds up.
+    try:
+        os.unlink(file_path)
+        logging.info('Removed leftover .part file: %s', os.path.basename(file_path))
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logging.warning('Could not remove .part file %s: %s', file_path, e)
+        return False
 
 
 def cleanup_part_files(directory):
-    """Removes leftover yt-dlp/ffmpeg partial files (.part) in the specified directory."""
+    """Removes leftover yt-dlp/ffmpeg partial files (.part) under the
+    specified directory, including the per-stream subdirectories.
+
+    When many partial files are left behind (e.g. after a crash with lots
+    of streams), deletions run on a small thread pool since unlink is
+    I/O-bound; small batches are removed serially to skip the pool setup.
+    """
     logging.debug(f"Checking for leftover '.part' files in {directory}")
-    removed_count = 0
-    for fname in os.listdir(directory):
-        if fname.endswith('.part'):
-            file_path = os.path.join(directory, fname)
-            try:
-                os.remove(file_path)
-                logging.info(f'Removed leftover .part file: {fname}')
-                removed_count += 1
-            except OSError as e:
-                logging.warning(f'Could not remove .part file {file_path}: {e}')
-            except Exception as e:
-                logging.warning(f'Unexpected error removing .part file {file_path}: {e}')
-    if removed_count == 0:
+    part_paths = []
+    for root, _dirs, files in os.walk(directory):
+        part_paths.extend(
+            os.path.join(root, fname) for fname in files if fname.endswith('.part')
+        )
+
+    if not part_paths:
         logging.debug("No leftover '.part' files found.")
+        return
 
-def download_segment(stream_url, stream_name, quality, output_dir, segment_duration_sec):
-    """Downloads a single segment for a given stream."""
-    thread_name = threading.current_thread().name
-    now = datetime.datetime.now()
-    timestamp = now.strftime('%Y-%m-%d_%H-%M-%S')
+    if len(part_paths) < 32:
+        removed_count = sum(map(_remove_part_file, part_paths))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='Cleanup') as pool:
+            removed_count = sum(pool.map(_remove_part_file, part_paths))
+
+    if removed_count == 0:
+        logging.debug("No leftover '.part' files removed.")
+
+def convert_segment(source_path, target_path, stream_name):
+    """Converts a downloaded segment to its target container with ffmpeg.
+
+    Runs on the converter pool so CPU-bound conversion overlaps with the
+    network-bound download of the next segment. Removes the source file
+    on success.
+    """
+    logging.info('Converting segment for %r -> %s', stream_name, os.path.basename(target_path))
+    try:
+        proc = subprocess.Popen(
+            ['ffmpeg', '-y', '-threads', '0', '-i', source_path, target_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        _register_child(proc)
+        try:
+            _, stderr = proc.communicate()
+        finally:
+            _unregister_child(proc)
+        if proc.returncode != 0:
+            logging.error('ffmpeg conversion failed for %r (exit %s): %s', stream_name, proc.returncode, stderr[-500:])
+            return
+        os.remove(source_path)
+        logging.info('Finished converting segment for %r', stream_name)
+    except OSError as e:
+        logging.error('Could not run ffmpeg conversion for %r: %s', stream_name, e)
+    except Exception as e:
+        logging.exception('An unexpected error occurred converting segment for %r: %s', stream_name, e)
+
+
+def _build_ydl_opts(quality, segment_duration_sec, recode_format=None):
+    """Builds the static per-stream yt-dlp options (everything but outtmpl).
+
+    Called once per stream in start_downloads so the dict and its argument
+    lists are not reallocated on every segment.
+    """
+    if recode_format:
+        # Download into a catch-all container; the converter pool produces
+        # the final file asynchronously.
+        container_args = ['-c', 'copy', '-f', 'matroska']
+    else:
+        container_args = ['-c', 'copy', '-movflags', '+faststart', '-f', 'mp4']
 
-    output_template = os.path.join(
-        output_dir,
-        f'{stream_name}_{timestamp}.%(ext)s'
-    )
     ydl_opts = {
         'format': quality,
-        'outtmpl': output_template,
         'external_downloader': 'ffmpeg',
-        'external_downloader_args': ['-y', '-t', str(segment_duration_sec)],
+        'external_downloader_args': [
+            '-y', '-t', str(segment_duration_sec),
+            # Batch writes: a large buffer and no per-packet flushing keeps
+            # metadata syscalls down when many streams record at once.
+            '-bufsize', '16M', '-flush_packets', '0',
+            '-max_muxing_queue_size', '4096',
+        ] + container_args,
         'quiet': True,
         'noprogress': True,
         'verbose': False,
-        'postprocessors': [{ 
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4', 
-        }],
     }
-
+    if not recode_format:
+        # If the quality selector picks separate video+audio formats,
+        # merge them by stream copy into mp4 rather than re-encoding.
+        ydl_opts['merge_output_format'] = 'mp4'
+    if _concurrency_controller is not None:
+        ydl_opts['progress_hooks'] = [_concurrency_controller.progress_hook]
+    return ydl_opts
+
+
+def download_segment(stream_url, stream_name, ydl_opts, output_prefix, recode_format=None):
+    """Downloads a single segment for a given stream.
+
+    'ydl_opts' is the stream's precomputed static option dict from
+    _build_ydl_opts; 'output_prefix' is the precomputed path prefix inside
+    the stream's own subdirectory
+    ('<output_dir>/<stream_name>/<stream_name>_'). Only the timestamp and
+    extension are computed per segment.
+
+    ffmpeg remuxes the stream straight into the final mp4 container in a
+    single pass (-c copy), so no second conversion pass is needed. Streams
+    whose codecs are not mp4-compatible can set 'recode' in their config
+    entry; those segments are downloaded into an intermediate .mkv and
+    handed to the converter pool, so conversion overlaps with the next
+    download instead of blocking this worker.
+    """
     try:
-        if shutdown_event.is_set():
-            logging.info(f'[{thread_name}] Shutdown signalled before starting download for {stream_name}. Aborting segment.')
-            return
+        import yt_dlp
+    except ImportError:
+        logging.error('yt-dlp is not installed; cannot download "%s". Install it with: pip install yt-dlp', stream_name)
+        raise
 
-        logging.info(f'[{thread_name}] Starting download segment for "{stream_name}" (URL: {stream_url[:30]}...)')
+    timestamp = f'{_strftime("%Y-%m-%d_%H-%M-%S")}_{next(_segment_counter):04d}'
+    extension = 'mkv' if recode_format else 'mp4'
+    output_template = f'{output_prefix}{timestamp}.{extension}'
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([stream_url])
+    acquired = False
+    try:
+        # No pre-download shutdown check: record_stream tests the event
+        # before each segment and acquire() fails once shutdown begins,
+        # so one post-download check is enough.
+        if _concurrency_controller is not None:
+            acquired = _concurrency_controller.acquire()
+            if not acquired:
+                logging.info('Shutdown signalled while waiting for a download slot for %s. Aborting segment.', stream_name)
+                return
+
+        logging.info('Starting download segment for %r (URL: %.30s...)', stream_name, stream_url)
+
+        # stream_name is part of the key on purpose: two entries sharing a
+        # URL and quality must not share an instance, because the output
+        # template below is mutated unsynchronized before each download.
+        ydl = _get_cached_ydl((stream_name, stream_url, ydl_opts['format'], recode_format), ydl_opts)
+        ydl.params['outtmpl'] = {'default': output_template}
+        ydl.download([stream_url])
 
         if shutdown_event.is_set():
-            logging.info(f'[{thread_name}] Shutdown signalled during/after download for {stream_name}. Segment likely saved.')
+            logging.info('Shutdown signalled during/after download for %s. Segment likely saved.', stream_name)
+
+        if recode_format and _convert_pool is not None and os.path.exists(output_template):
+            target_path = f'{os.path.splitext(output_template)[0]}.{recode_format.lower()}'
+            if target_path == output_template:
+                # 'recode': 'mkv' matches the intermediate container; an
+                # ffmpeg run reading and writing the same file would
+                # corrupt the segment, and there is nothing to convert.
+                logging.info('Segment for %r is already in the requested %s container; skipping conversion.', stream_name, recode_format)
+            else:
+                _convert_pool.submit(convert_segment, output_template, target_path, stream_name)
 
-        logging.info(f'[{thread_name}] Successfully downloaded segment for "{stream_name}"')
+        logging.info('Successfully downloaded segment for %r', stream_name)
 
     except yt_dlp.utils.DownloadError as e:
-        logging.error(f'[{thread_name}] Download failed for "{stream_name}": {e}')
-        
+        logging.error('Download failed for %r: %s', stream_name, e)
+
     except Exception as e:
-        logging.exception(f'[{thread_name}] An unexpected error occurred during download for "{stream_name}": {e}')
+        logging.exception('An unexpected error occurred during download for %r: %s', stream_name, e)
+
+    finally:
+        if acquired:
+            _concurrency_controller.release()
+
+
+# Resolved direct media URLs, keyed by (stream_url, quality). YouTube
+# signs these for roughly 6 hours; entries expire conservatively after 5
+# so a stale URL is re-resolved instead of handed to ffmpeg.
+_MANIFEST_TTL_SEC = 5 * 3600
+_manifest_cache = {}
+_manifest_cache_lock = threading.Lock()
+_manifest_cache_path = None
+
+
+def _init_manifest_cache(output_dir):
+    """Points the resolved-URL cache at its on-disk file and loads it.
+
+    Persisting the cache means a restart (crash, redeploy, schedule tick)
+    within the signed-URL TTL skips the extractor round-trip entirely.
+    """
+    global _manifest_cache_path
+    _manifest_cache_path = os.path.join(output_dir, '.url_cache.json')
+    try:
+        with open(_manifest_cache_path, 'rb') as f:
+            entries = _json_loads(f.read())
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logging.warning(f'Could not load resolved-URL cache {_manifest_cache_path}: {e}')
+        return
+
+    # Best-effort cache: malformed contents must never abort startup, so
+    # anything that is not the expected shape is simply skipped.
+    if not isinstance(entries, list):
+        logging.warning(f'Ignoring malformed resolved-URL cache {_manifest_cache_path}: expected a list of entries.')
+        return
+
+    now = time.time()
+    loaded = 0
+    with _manifest_cache_lock:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                if entry['expires_at'] > now:
+                    cache_key = (entry['stream_url'], entry['quality'])
+                    _manifest_cache[cache_key] = (entry['manifest_url'], entry['expires_at'])
+                    loaded += 1
+            except (KeyError, TypeError):
+                continue
+    if loaded:
+        logging.info(f'Loaded {loaded} unexpired resolved stream URL(s) from cache.')
+
+
+def _save_manifest_cache():
+    """Writes the resolved-URL cache atomically (write temp, os.replace).
+
+    The lock is held across the write and replace, not just the snapshot:
+    workers resolving concurrently all target the same fixed temp path,
+    and interleaved writes would os.replace garbled JSON into place.
+    """
+    if _manifest_cache_path is None:
+        return
+    with _manifest_cache_lock:
+        entries = [
+            {
+                'stream_url': key[0],
+                'quality': key[1],
+                'manifest_url': value[0],
+                'expires_at': value[1],
+            }
+            for key, value in _manifest_cache.items()
+        ]
+        temp_path = f'{_manifest_cache_path}.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(temp_path, _manifest_cache_path)
+        except OSError as e:
+            logging.warning(f'Could not persist resolved-URL cache {_manifest_cache_path}: {e}')
+
+
+def _resolve_stream_manifest(stream_url, quality, force_refresh=False):
+    """Resolves the direct media URL (e.g. HLS manifest) for a stream.
+
+    Results are cached with a TTL so repeated recordings (and restarts of
+    the segmenter) skip the extractor round-trip entirely; pass
+    force_refresh=True after a failure that suggests the URL expired.
+    Uses a cached metadata-only YoutubeDL so the download machinery is
+    skipped. Returns None when the quality selector resolves to multiple
+    formats (separate video+audio), which a single ffmpeg input cannot
+    consume.
+    """
+    cache_key = (stream_url, quality)
+    if not force_refresh:
+        with _manifest_cache_lock:
+            cached = _manifest_cache.get(cache_key)
+        if cached is not None and time.time() < cached[1]:
+            return cached[0]
+
+    resolve_opts = {
+        'format': quality,
+        'quiet': True,
+        'noprogress': True,
+        'verbose': False,
+    }
+    ydl = _get_cached_ydl((stream_url, quality, 'resolve'), resolve_opts)
+    info = ydl.extract_info(stream_url, download=False)
+    if not info or info.get('requested_formats'):
+        return None
+    manifest_url = info.get('url')
+    if manifest_url:
+        with _manifest_cache_lock:
+            _manifest_cache[cache_key] = (manifest_url, time.time() + _MANIFEST_TTL_SEC)
+        _save_manifest_cache()
+    return manifest_url
+
+
+def _record_with_ffmpeg_segmenter(manifest_url, stream_name, output_prefix, segment_duration_sec, max_segments):
+    """Records a stream with one long-lived ffmpeg that segments internally.
+
+    ffmpeg's segment muxer rolls over to a new timestamped mp4 every
+    segment_duration_sec, so there is no per-segment process spawn,
+    manifest re-fetch or muxer re-init at all. A finite max_segments is
+    enforced with '-t'; 0 records until shutdown. Returns True when
+    recording ended cleanly (or via shutdown), False when ffmpeg failed
+    and the caller should fall back or re-resolve.
+    """
+    command = ['ffmpeg', '-y', '-i', manifest_url]
+    if max_segments:
+        command += ['-t', str(segment_duration_sec * max_segments)]
+    command += [
+        '-c', 'copy',
+        '-bufsize', '16M', '-flush_packets', '0',
+        '-max_muxing_queue_size', '4096',
+        '-f', 'segment',
+        '-segment_time', str(segment_duration_sec),
+        '-reset_timestamps', '1',
+        '-segment_format', 'mp4',
+        '-segment_format_options', 'movflags=+faststart',
+        '-strftime', '1',
+        f'{output_prefix}%Y-%m-%d_%H-%M-%S.mp4',
+    ]
+
+    logging.info('Starting long-lived ffmpeg segmenter for %r', stream_name)
+    try:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except OSError as e:
+        logging.error('Could not start ffmpeg segmenter for %r: %s', stream_name, e)
+        return False
+
+    _register_child(proc)
+    try:
+        _, stderr = proc.communicate()
+    finally:
+        _unregister_child(proc)
+
+    if proc.returncode == 0 or shutdown_event.is_set():
+        logging.info('ffmpeg segmenter finished for %r', stream_name)
+        return True
+
+    logging.warning('ffmpeg segmenter exited with %s for %r: %s', proc.returncode, stream_name, stderr[-500:])
+    return False
+
+
+def record_stream(stream_url, stream_name, quality, ydl_opts, output_prefix, segment_duration_sec, max_segments, recode_format=None):
+    """Records one stream, in timed segments, until done or shut down.
+
+    Preferred path: resolve the stream's direct media URL once and hand
+    it to a single long-lived ffmpeg whose segment muxer rolls the output
+    file internally — one process for the whole recording instead of a
+    yt-dlp + ffmpeg spawn per segment. Streams that need recoding, that
+    resolve to split video+audio formats, or whose ffmpeg run fails drop
+    to the per-segment yt-dlp loop below.
+
+    In the fallback loop, segment boundaries are scheduled against
+    time.monotonic() deadlines (start + N * segment_duration), so setup
+    time and failed downloads do not make the boundaries drift; a segment
+    that ends early (e.g. a stream hiccup) waits for its deadline instead
+    of hammering the source. max_segments of 0 records until shutdown.
+    """
+    if not recode_format:
+        # First attempt may use a cached media URL; if ffmpeg then fails
+        # (typically because the signed URL expired), force one fresh
+        # resolution before giving up on the direct path.
+        for force_refresh in (False, True):
+            if shutdown_event.is_set():
+                return
+            manifest_url = None
+            try:
+                manifest_url = _resolve_stream_manifest(stream_url, quality, force_refresh=force_refresh)
+            except Exception as e:
+                logging.warning(f'Could not resolve direct media URL for "{stream_name}": {e}')
+            if not manifest_url:
+                break
+
+            acquired = _concurrency_controller is not None and _concurrency_controller.acquire()
+            if _concurrency_controller is not None and not acquired:
+                return
+            try:
+                if _record_with_ffmpeg_segmenter(manifest_url, stream_name, output_prefix, segment_duration_sec, max_segments):
+                    return
+            finally:
+                if acquired:
+                    _concurrency_controller.release()
+        if not shutdown_event.is_set():
+            logging.info(f'Falling back to per-segment yt-dlp downloads for "{stream_name}".')
+
+    segments_done = 0
+    deadline = time.monotonic()
+    while not shutdown_event.is_set():
+        deadline += segment_duration_sec
+        download_segment(stream_url, stream_name, ydl_opts, output_prefix, recode_format)
+        segments_done += 1
+        if max_segments and segments_done >= max_segments:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining > 0 and shutdown_event.wait(timeout=remaining):
+            break
+    logging.info(f'Finished recording "{stream_name}" ({segments_done} segment(s)).')
 
 
 def start_downloads(config):
-    """Initializes and manages the download threads."""
+    """Initializes and manages the download worker pool."""
     output_dir = config.get('output_dir')
     segment_duration = config.get('segment_duration')
+    # How many segments to record per stream; 0 keeps recording until
+    # shutdown. Defaults to 1, the historical single-segment behaviour.
+    segments_per_stream = config.get('segments_per_stream', 1)
     streams = config.get('streams', [])
 
     if not streams:
@@ -182,49 +776,95 @@ def start_downloads(config):
         return
 
     logging.info(f'Starting download process for {len(streams)} configured streams...')
-    active_threads = []
+    max_workers = config.get('max_workers', min(32, len(streams)))
+
+    global _concurrency_controller, _convert_pool
+    _concurrency_controller = AdaptiveConcurrencyController(
+        min_workers=config.get('min_workers', 1),
+        max_workers=max_workers,
+    )
+    _concurrency_controller.start()
+
+    # Each conversion ffmpeg already fans out over all cores (-threads 0),
+    # so a pool of cpu_count()/2 submitters is enough to keep them fed.
+    _convert_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 2) // 2),
+        thread_name_prefix='Convert'
+    )
+
+    # Threads (not a process pool) on purpose: the heavy lifting happens in
+    # external ffmpeg child processes, so workers spend their time blocked on
+    # I/O with the GIL released, and the shutdown event, concurrency
+    # controller and converter pool all rely on shared in-process state.
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix='Download'
+    )
+    futures = {}
     for stream_config in streams:
-        if not isinstance(stream_config, dict) or not all(k in stream_config for k in ('url', 'stream_name', 'quality')):
-            logging.warning(f'Skipping invalid stream entry: {stream_config}. Must be a dict with "url", "stream_name", and "quality".')
+        # Entries were validated at config-load time.
+        # Each stream records into its own subdirectory so concurrent file
+        # creation/renames do not contend on one parent directory.
+        stream_dir = os.path.join(output_dir, stream_config['stream_name'])
+        try:
+            _ensure_dir(stream_dir)
+        except OSError as e:
+            logging.error(f'Could not create stream directory "{stream_dir}": {e}. Skipping stream.')
             continue
 
-        thread = threading.Thread(
-            target=download_segment,
-            args=(
-                stream_config['url'],
-                stream_config['stream_name'],
-                stream_config['quality'],
-                output_dir,
-                segment_duration,
-            ),
-            name=f'Thread-{stream_config["stream_name"][:15]}'
+        output_prefix = os.path.join(stream_dir, f'{stream_config["stream_name"]}_')
+        recode_format = stream_config.get('recode')
+        future = pool.submit(
+            record_stream,
+            stream_config['url'],
+            stream_config['stream_name'],
+            stream_config['quality'],
+            _build_ydl_opts(stream_config['quality'], segment_duration, recode_format),
+            output_prefix,
+            segment_duration,
+            segments_per_stream,
+            recode_format,
         )
-        thread.start()
-        active_threads.append(thread)
+        futures[future] = stream_config['stream_name']
 
-    if not active_threads:
-        logging.warning('No valid streams found to start download threads.')
+    if not futures:
+        logging.warning('No valid streams found to submit for download.')
+        pool.shutdown(wait=False)
+        _convert_pool.shutdown(wait=False)
         return
 
-    logging.info(f'{len(active_threads)} download threads started.')
+    logging.info(f'{len(futures)} downloads submitted to pool ({max_workers} workers).')
 
     try:
-        while any(t.is_alive() for t in active_threads):
-            time.sleep(1)
-
-        logging.info('All download threads appear to have completed their tasks.')
+        concurrent.futures.wait(futures)
+
+        # wait() never raises worker exceptions; surface them explicitly so
+        # a crashed worker cannot pass for a successful run.
+        failed = 0
+        for future, stream_name in futures.items():
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                logging.error(f'Recording worker for "{stream_name}" failed: {error!r}')
+        if failed:
+            logging.warning(f'{failed} of {len(futures)} recording workers failed; see errors above.')
+        else:
+            logging.info('All downloads appear to have completed their tasks.')
 
     except KeyboardInterrupt:
-        logging.warning('Ctrl+C detected. Signaling download threads to shut down gracefully...')
+        logging.warning('Ctrl+C detected. Signaling download workers to shut down gracefully...')
         shutdown_event.set()
-        logging.info('Shutdown signal sent to all threads.')
+        _concurrency_controller.stop()
+        logging.info('Shutdown signal sent to all workers.')
 
     finally:
-        logging.info('Waiting for all download threads to finish completely...')
-        for thread in active_threads:
-            thread.join()
-            logging.debug(f'Thread {thread.name} has finished.')
-        logging.info('All download threads have finished execution.')
+        logging.info('Waiting for all download workers to finish completely...')
+        pool.shutdown(wait=True, cancel_futures=True)
+        _concurrency_controller.stop()
+        logging.info('Draining pending segment conversions...')
+        _convert_pool.shutdown(wait=True)
+        _close_cached_ydls()
+        logging.info('All download and conversion workers have finished execution.')
 
 
 def handle_scheduling(schedule_enabled, get_start_time_func, stop_event):
@@ -287,7 +927,7 @@ def main():
     """
     config = load_configuration(CONFIG_FILE)
 
-    setup_logging(config.get('log_file')) 
+    log_listener = setup_logging(config.get('log_file'))
 
     logging.info("Checking for ffmpeg...")
     if shutil.which('ffmpeg') is None:
@@ -299,9 +939,10 @@ def main():
 
     output_dir = config.get('output_dir') 
     try:
-        os.makedirs(output_dir, exist_ok=True)
+        _ensure_dir(output_dir)
         logging.info(f'Output directory set to: "{output_dir}"')
         cleanup_part_files(output_dir)
+        _init_manifest_cache(output_dir)
     except OSError as e:
         logging.error(f'Could not create or access output directory "{output_dir}": {e}')
         sys.exit(1)
@@ -314,11 +955,13 @@ def main():
     should_execute_now = handle_scheduling(schedule_enabled, get_start_time_from_user, shutdown_event)
 
     if should_execute_now:
+        signal.signal(signal.SIGINT, _on_sigint)
         start_downloads(config)
     else:
         logging.info("Downloads were not started due to scheduling cancellation or configuration.")
 
     logging.info('Script finished execution.')
+    log_listener.stop()
 
 if __name__ == '__main__':
     main()